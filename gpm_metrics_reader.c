@@ -7,7 +7,17 @@
  *   gcc -o gpm_metrics_reader gpm_metrics_reader.c -lnvidia-ml -I/usr/local/cuda/include -L/usr/local/cuda/lib64
  * 
  * Usage:
- *   ./gpm_metrics_reader
+ *   ./gpm_metrics_reader            Print one sample and exit
+ *   ./gpm_metrics_reader --stream   Print one sample per line read from stdin,
+ *                                   each followed by a STREAM_END_MARKER line
+ *
+ *   --schema-only-first             With --stream, print metric names and units
+ *                                   only in the first sample; later samples list
+ *                                   just ID, Value and Status
+ *   --csv                           Print "#META device_id,gi,ci,name" for each
+ *                                   device followed by one
+ *                                   "metric_id,metric_name,value,unit" line per
+ *                                   successful metric; status messages go to stderr
  */
 
 #include <stdio.h>
@@ -18,6 +28,7 @@
 
 #define MAX_MIG_DEVICES 64
 #define SAMPLE_INTERVAL_MS 150
+#define STREAM_END_MARKER "#END"
 
 // List of metric to query - add/remove them here
 // https://docs.nvidia.com/deploy/nvml-api/group__nvmlGpmEnums.html
@@ -38,6 +49,20 @@ static const nvmlGpmMetricId_t METRICS_TO_QUERY[] = {
     NVML_GPM_METRIC_PCIE_RX_PER_SEC,
 };
 
+// Set by --schema-only-first
+static int schema_only_first = 0;
+
+// Set once a metric's name and unit were printed in a successful row; with
+// --schema-only-first, tables where every successful metric has this set
+// leave them out
+static int schema_sent[sizeof(METRICS_TO_QUERY) / sizeof(METRICS_TO_QUERY[0])];
+
+// Set by --csv
+static int csv_output = 0;
+
+// Status messages go to stderr in CSV mode so stdout only carries rows
+#define INFO_OUT (csv_output ? stderr : stdout)
+
 typedef struct {
     nvmlDevice_t device;
     nvmlGpuInstance_t gpuInstance;
@@ -48,6 +73,7 @@ typedef struct {
 } MigDeviceInfo;
 
 void print_separator(void) {
+    if (csv_output) return;
     printf("\n");
     for (int i = 0; i < 70; i++) printf("=");
     printf("\n");
@@ -84,10 +110,90 @@ void print_mig_info(unsigned int gpuInstanceId, unsigned int computeInstanceId)
     printf("MIG Slice - GI: %u, CI: %u\n", gpuInstanceId, computeInstanceId);
 }
 
+void print_csv_meta(nvmlDevice_t device, unsigned int deviceIdx, const MigDeviceInfo *mig) {
+    char name[NVML_DEVICE_NAME_BUFFER_SIZE];
+    nvmlReturn_t result;
+    
+    result = nvmlDeviceGetName(device, name, NVML_DEVICE_NAME_BUFFER_SIZE);
+    if (result != NVML_SUCCESS) {
+        print_nvml_error("nvmlDeviceGetName", result);
+        snprintf(name, sizeof(name), "Unknown");
+    }
+    
+    // Name goes last so commas in it don't shift the other fields
+    if (mig) {
+        printf("#META %u,%u,%u,%s\n", deviceIdx, mig->gpuInstanceId, mig->computeInstanceId, name);
+    } else {
+        printf("#META %u,,,%s\n", deviceIdx, name);
+    }
+}
+
+void print_metrics_csv(nvmlGpmMetricsGet_t *metricsGet) {
+    // Print successful metrics in the order they were requested
+    for (size_t i = 0; i < sizeof(METRICS_TO_QUERY) / sizeof(METRICS_TO_QUERY[0]); i++) {
+        for (unsigned int j = 0; j < metricsGet->numMetrics; j++) {
+            nvmlGpmMetric_t *metric = &metricsGet->metrics[j];
+            
+            if (metric->metricId != METRICS_TO_QUERY[i]) {
+                continue;
+            }
+            
+            if (metric->nvmlReturn == NVML_SUCCESS) {
+                const char *longName = (metric->metricInfo.longName && metric->metricInfo.longName[0]) ? metric->metricInfo.longName : "Unknown";
+                const char *unit = metric->metricInfo.unit ? metric->metricInfo.unit : "";
+                char name[64];
+                
+                // Same metric_name the table parser produces
+                snprintf(name, sizeof(name), "%s", longName);
+                for (char *c = name; *c; c++) {
+                    if (*c == ' ' || *c == ',') *c = '_';
+                }
+                
+                printf("%u,%s,%.2f,%s\n", metric->metricId, name, metric->value, unit);
+            }
+            break;
+        }
+    }
+}
+
+void print_metric_row(int compact, unsigned int id, const char *name, const char *value,
+                      const char *unit, const char *status) {
+    if (compact) {
+        printf("  %-5u %12s %8s\n", id, value, status);
+    } else {
+        printf("  %-5u %-35s %12s %10s %8s\n", id, name, value, unit, status);
+    }
+}
+
 void print_metrics(nvmlGpmMetricsGet_t *metricsGet) {
-    printf("\n  %-5s %-35s %12s %10s %8s\n", "ID", "Name", "Value", "Unit", "Status");
-    printf("  %-5s %-35s %12s %10s %8s\n", "-----", "-----------------------------------", 
-           "------------", "----------", "--------");
+    if (csv_output) {
+        print_metrics_csv(metricsGet);
+        return;
+    }
+    
+    // A metric that failed so far still needs its name and unit sent the
+    // first time it succeeds, so that table is printed in full
+    int compact = schema_only_first;
+    for (size_t i = 0; compact && i < sizeof(METRICS_TO_QUERY) / sizeof(METRICS_TO_QUERY[0]); i++) {
+        for (unsigned int j = 0; j < metricsGet->numMetrics; j++) {
+            nvmlGpmMetric_t *metric = &metricsGet->metrics[j];
+            if (metric->metricId == METRICS_TO_QUERY[i]) {
+                if (metric->nvmlReturn == NVML_SUCCESS && !schema_sent[i]) {
+                    compact = 0;
+                }
+                break;
+            }
+        }
+    }
+    
+    if (compact) {
+        printf("\n  %-5s %12s %8s\n", "ID", "Value", "Status");
+        printf("  %-5s %12s %8s\n", "-----", "------------", "--------");
+    } else {
+        printf("\n  %-5s %-35s %12s %10s %8s\n", "ID", "Name", "Value", "Unit", "Status");
+        printf("  %-5s %-35s %12s %10s %8s\n", "-----", "-----------------------------------", 
+               "------------", "----------", "--------");
+    }
     
     // Print metrics in the order they were requested
     for (size_t i = 0; i < sizeof(METRICS_TO_QUERY) / sizeof(METRICS_TO_QUERY[0]); i++) {
@@ -103,34 +209,22 @@ void print_metrics(nvmlGpmMetricsGet_t *metricsGet) {
                 const char *status = (metric->nvmlReturn == NVML_SUCCESS) ? "OK" : "FAIL";
                 
                 if (metric->nvmlReturn == NVML_SUCCESS) {
-                    const char *name = metric->metricInfo.longName ? metric->metricInfo.longName : "Unknown";
+                    const char *name = (metric->metricInfo.longName && metric->metricInfo.longName[0]) ? metric->metricInfo.longName : "Unknown";
                     const char *unit = metric->metricInfo.unit ? metric->metricInfo.unit : "";
+                    char value[32];
                     
-                    printf("  %-5u %-35s %12.2f %10s %8s\n", 
-                           metric->metricId,
-                           name,
-                           metric->value,
-                           unit,
-                           status);
+                    snprintf(value, sizeof(value), "%.2f", metric->value);
+                    print_metric_row(compact, metric->metricId, name, value, unit, status);
+                    schema_sent[i] = 1;
                 } else {
-                    printf("  %-5u %-35s %12s %10s %8s\n", 
-                           requestedId,
-                           "N/A",
-                           "N/A",
-                           "",
-                           status);
+                    print_metric_row(compact, requestedId, "N/A", "N/A", "", status);
                 }
                 break;
             }
         }
         
         if (!found) {
-            printf("  %-5u %-35s %12s %10s %8s\n", 
-                   requestedId,
-                   "N/A",
-                   "N/A",
-                   "",
-                   "MISS");
+            print_metric_row(compact, requestedId, "N/A", "N/A", "", "MISS");
         }
     }
 }
@@ -146,12 +240,12 @@ int query_gpm_metrics(nvmlDevice_t device, int isMig, unsigned int gpuInstanceId
     // Check if GPM is supported
     result = nvmlGpmQueryDeviceSupport(device, &gpmSupport);
     if (result != NVML_SUCCESS) {
-        printf("  GPM not supported on this device\n");
+        fprintf(INFO_OUT, "  GPM not supported on this device\n");
         return -1;
     }
     
     if (!gpmSupport.isSupportedDevice) {
-        printf("  GPM support not available\n");
+        fprintf(INFO_OUT, "  GPM support not available\n");
         return -1;
     }
     
@@ -298,8 +392,62 @@ int get_mig_devices(MigDeviceInfo *migDevices, int maxDevices) {
     return migCount;
 }
 
+void query_all_devices(MigDeviceInfo *migDevices, int migCount) {
+    if (migCount == 0) {
+        // Fall back to regular GPU monitoring
+        unsigned int deviceCount;
+        nvmlReturn_t result = nvmlDeviceGetCount(&deviceCount);
+        
+        if (result == NVML_SUCCESS) {
+            for (unsigned int i = 0; i < deviceCount; i++) {
+                nvmlDevice_t device;
+                result = nvmlDeviceGetHandleByIndex(i, &device);
+                
+                if (result == NVML_SUCCESS) {
+                    if (csv_output) {
+                        print_csv_meta(device, i, NULL);
+                    } else {
+                        print_device_info(device, i);
+                    }
+                    query_gpm_metrics(device, 0, 0);
+                }
+            }
+        }
+    } else {
+        // Query metrics for each MIG device
+        for (int i = 0; i < migCount; i++) {
+            if (csv_output) {
+                print_csv_meta(migDevices[i].device, migDevices[i].deviceIdx, &migDevices[i]);
+            } else {
+                print_device_info(migDevices[i].device, migDevices[i].deviceIdx);
+                print_mig_info(migDevices[i].gpuInstanceId, migDevices[i].computeInstanceId);
+            }
+            query_gpm_metrics(migDevices[i].device, 1, migDevices[i].gpuInstanceId);
+        }
+    }
+    
+    if (!csv_output) {
+        print_separator();
+        printf("\n");
+    }
+}
+
 int main(int argc, char *argv[]) {
     nvmlReturn_t result;
+    int stream = 0;
+    
+    for (int i = 1; i < argc; i++) {
+        if (strcmp(argv[i], "--stream") == 0) {
+            stream = 1;
+        } else if (strcmp(argv[i], "--schema-only-first") == 0) {
+            schema_only_first = 1;
+        } else if (strcmp(argv[i], "--csv") == 0) {
+            csv_output = 1;
+        } else {
+            fprintf(stderr, "Usage: %s [--csv] [--stream [--schema-only-first]]\n", argv[0]);
+            return 1;
+        }
+    }
     
     // Initialize NVML
     result = nvmlInit();
@@ -308,7 +456,7 @@ int main(int argc, char *argv[]) {
         return 1;
     }
     
-    printf("✓ NVML initialized successfully\n");
+    fprintf(INFO_OUT, "✓ NVML initialized successfully\n");
     
     // Get MIG devices
     MigDeviceInfo migDevices[MAX_MIG_DEVICES];
@@ -321,39 +469,25 @@ int main(int argc, char *argv[]) {
     }
     
     if (migCount == 0) {
-        printf("\n⚠ No MIG devices found. Checking regular GPUs...\n");
-        
-        // Fall back to regular GPU monitoring
-        unsigned int deviceCount;
-        result = nvmlDeviceGetCount(&deviceCount);
-        
-        if (result == NVML_SUCCESS) {
-            for (unsigned int i = 0; i < deviceCount; i++) {
-                nvmlDevice_t device;
-                result = nvmlDeviceGetHandleByIndex(i, &device);
-                
-                if (result == NVML_SUCCESS) {
-                    print_device_info(device, i);
-                    query_gpm_metrics(device, 0, 0);
-                }
-            }
-        }
+        fprintf(INFO_OUT, "\n⚠ No MIG devices found. Checking regular GPUs...\n");
     } else {
-        printf("\n✓ Found %d MIG device(s)\n", migCount);
-        
-        // Query metrics for each MIG device
-        for (int i = 0; i < migCount; i++) {
-            print_device_info(migDevices[i].device, migDevices[i].deviceIdx);
-            print_mig_info(migDevices[i].gpuInstanceId, migDevices[i].computeInstanceId);
-            query_gpm_metrics(migDevices[i].device, 1, migDevices[i].gpuInstanceId);
-        }
+        fprintf(INFO_OUT, "\n✓ Found %d MIG device(s)\n", migCount);
     }
     
-    print_separator();
-    printf("\n");
+    if (stream) {
+        // NVML stays initialized across samples; stop when stdin is closed
+        char request[64];
+        while (fgets(request, sizeof(request), stdin) != NULL) {
+            query_all_devices(migDevices, migCount);
+            printf("%s\n", STREAM_END_MARKER);
+            fflush(stdout);
+        }
+    } else {
+        query_all_devices(migDevices, migCount);
+    }
     
     // Cleanup
     nvmlShutdown();
     
     return 0;
-}
\ No newline at end of file
+}
@@ -2,7 +2,12 @@
 """
 Continuous GPM metrics monitoring wrapper
 
-Runs gpm_metrics_reader repeatedly and outputs CSV format for plotting.
+Samples GPM metrics through the NVML Python bindings (pynvml) and outputs
+CSV format for plotting. pynvml samples one GPU, so it is used when NVML sees a
+single GPU without MIG or --device/--gpu-instance picks one. Otherwise, or
+when pynvml is not installed or can't sample GPM, or --binary is given, falls
+back to keeping gpm_metrics_reader running in --stream mode and parsing the
+output it prints for every GPU and MIG slice in every sample.
 
 Usage:
     python gpm_monitor.py [options]
@@ -11,192 +16,887 @@ Options:
     --interval MSEC     Sampling interval in milliseconds (default: 1000)
     --duration SEC      Total duration in seconds (default: infinite)
     --output FILE       Output CSV file (default: stdout)
-    --binary PATH       Path to gpm_metrics_reader binary (default: ./gpm_metrics_reader)
+    --binary PATH       Use the gpm_metrics_reader binary at PATH instead of pynvml
+                        (default without pynvml: ./gpm_metrics_reader)
+    --device N          GPU index for the pynvml backend (default: 0)
+    --gpu-instance GI   MIG GPU instance ID for the pynvml backend (default: none)
+    --timestamp FORMAT  Timestamp column format: epoch_ns or iso (default: epoch_ns)
+    --schema-only-first Ask the reader binary to print metric names and units
+                        only in its first sample
+    --format FORMAT     Output format: csv or parquet (default: csv; parquet
+                        needs pyarrow)
+    --reader-format F   How the reader binary prints samples: csv rows passed
+                        straight into CSV output, or its table parsed every
+                        sample (default: csv; table for parquet output or
+                        --schema-only-first)
+    --realtime          Run with SCHED_FIFO priority and locked memory to
+                        reduce wakeup jitter (mostly useful below ~50ms)
+    --pin-cpu N         Pin the monitor to CPU N
 """
 
 import subprocess
 import sys
+import os
+import ctypes
+import ctypes.util
+import csv
+import io
 import time
 import re
 import argparse
 import signal
+import queue
+import selectors
+import threading
+from itertools import repeat
 from datetime import datetime
 
+try:
+    import gpm_parse
+except ImportError:
+    gpm_parse = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+try:
+    import pynvml
+    _NVMLError = pynvml.NVMLError
+except ImportError:
+    pynvml = None
+    _NVMLError = ()
+
+
+# Same metrics, in the same order, as METRICS_TO_QUERY in gpm_metrics_reader.c
+GPM_METRICS = (
+    'GRAPHICS_UTIL',
+    'SM_UTIL',
+    'SM_OCCUPANCY',
+    'INTEGER_UTIL',
+    'ANY_TENSOR_UTIL',
+    'DFMA_TENSOR_UTIL',
+    'HMMA_TENSOR_UTIL',
+    'IMMA_TENSOR_UTIL',
+    'DRAM_BW_UTIL',
+    'FP64_UTIL',
+    'FP32_UTIL',
+    'FP16_UTIL',
+    'PCIE_TX_PER_SEC',
+    'PCIE_RX_PER_SEC',
+)
+
+# gpm_metrics_reader output is parsed as bytes; only the fields that end up
+# in a sample are decoded
+
+# gpm_metrics_reader device info lines
+_GPU_RE = re.compile(rb'GPU (\d+): (.+)')
+_MIG_RE = re.compile(rb'GI: (\d+), CI: (\d+)')
+
+# Metrics table row: ID, Name (may contain spaces), Value, Unit (may be empty),
+# Status. Units are never numbers, so a number before the status is the value
+# even when the name ends in one
+_NUMBER = rb'-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?'
+_METRIC_RE = re.compile(
+    rb'^\s*(\d+)\s+(\S.*?)\s+(%s)(?:\s+(?!%s\s)(\S+))?\s+(\S+)\s*$' % (_NUMBER, _NUMBER)
+)
+
+# gpm_metrics_reader --stream prints this line after every sample
+STREAM_END_MARKER = b'#END'
+STREAM_END_LINE = STREAM_END_MARKER + b'\n'
+
+# A reader that hasn't finished answering a request by then is restarted
+READER_TIMEOUT_SEC = 10.0
+
+# Largest read from the reader's stdout
+READER_READ_SIZE = 1 << 16
+
+# gpm_metrics_reader --csv starts each device with "#META device_id,gi,ci,name"
+CSV_META_PREFIX = b'#META '
+
+# CSV output is buffered and flushed when the buffer fills or every
+# FLUSH_EVERY_SAMPLES samples
+OUTPUT_BUFFER_SIZE = 1 << 16
+FLUSH_EVERY_SAMPLES = 64
+
+# Formatted samples waiting for the writer thread; samples are dropped
+# rather than delaying the sampler when it is full
+WRITE_QUEUE_SIZE = 1024
+WRITE_BATCH_SIZE = 64
+
+# Progress line on stderr is refreshed at most this often, and only on a TTY
+PROGRESS_INTERVAL_SEC = 1.0
+
+# Parquet output is written as one row group per PARQUET_ROW_GROUP_SAMPLES samples
+PARQUET_ROW_GROUP_SAMPLES = 4096
+
+# SCHED_FIFO priority used by --realtime
+REALTIME_PRIORITY = 10
+
+# mlockall() flags from <sys/mman.h> on Linux
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+# GPM needs two samples taken more than 100ms apart
+GPM_MIN_WINDOW_SEC = 0.1
+
+
+class Sample:
+    """One sample of one device: device fields plus parallel metric columns"""
+
+    __slots__ = ('device_id', 'device_name', 'gpu_instance_id', 'compute_instance_id',
+                 'ids', 'names', 'values', 'units')
+
+    def __init__(self, device_id, device_name, gpu_instance_id, compute_instance_id,
+                 ids, names, values, units):
+        self.device_id = device_id
+        self.device_name = device_name
+        self.gpu_instance_id = gpu_instance_id
+        self.compute_instance_id = compute_instance_id
+        self.ids = ids
+        self.names = names
+        self.values = values
+        self.units = units
+
+
+class NvmlBackend:
+    """Sample GPM metrics in-process through pynvml, without forking a reader"""
+
+    def __init__(self, device_index=0, gpu_instance_id=None):
+        pynvml.nvmlInit()
+        try:
+            self.device = pynvml.nvmlDeviceGetHandleByIndex(device_index)
+            support = pynvml.nvmlGpmQueryDeviceSupport(self.device)
+            if not support.isSupportedDevice:
+                raise RuntimeError(f"GPM not supported on GPU {device_index}")
+
+            name = pynvml.nvmlDeviceGetName(self.device)
+            if isinstance(name, bytes):
+                name = name.decode()
+
+            self.gpu_instance_id = gpu_instance_id
+            # Looked up here so a pynvml without the GPM bindings fails
+            # before the first sample
+            self.metrics_get_type = pynvml.c_nvmlGpmMetricsGet_t
+            self.metrics_get_version = pynvml.NVML_GPM_METRICS_GET_VERSION
+            self.metric_ids = [getattr(pynvml, f'NVML_GPM_METRIC_{m}') for m in GPM_METRICS]
+            # metric_id -> (name, unit), filled from the first successful sample
+            self.metric_info = {}
+            # device_id, device_name, gpu_instance_id, compute_instance_id
+            self.device_fields = (
+                str(device_index),
+                name,
+                '' if gpu_instance_id is None else str(gpu_instance_id),
+                '',
+            )
+
+            # Keep the previous sample around so every call only takes one new
+            # sample and measures the window since the last call
+            self.prev_sample = pynvml.nvmlGpmSampleAlloc()
+            self.next_sample = pynvml.nvmlGpmSampleAlloc()
+            self._take(self.prev_sample)
+            self.prev_time = time.monotonic()
+        except BaseException:
+            pynvml.nvmlShutdown()
+            raise
+
+    @staticmethod
+    def single_whole_gpu():
+        """True if NVML sees exactly one GPU and it isn't in MIG mode"""
+        pynvml.nvmlInit()
+        try:
+            if pynvml.nvmlDeviceGetCount() != 1:
+                return False
+            device = pynvml.nvmlDeviceGetHandleByIndex(0)
+            try:
+                current_mode, _ = pynvml.nvmlDeviceGetMigMode(device)
+            except _NVMLError:
+                # GPU without MIG support
+                return True
+            return current_mode != pynvml.NVML_DEVICE_MIG_ENABLE
+        finally:
+            pynvml.nvmlShutdown()
+
+    def _take(self, sample):
+        if self.gpu_instance_id is None:
+            pynvml.nvmlGpmSampleGet(self.device, sample)
+        else:
+            pynvml.nvmlGpmMigSampleGet(self.device, self.gpu_instance_id, sample)
+
+    def sample(self):
+        """Return metrics over the window since the previous call"""
+        wait = GPM_MIN_WINDOW_SEC - (time.monotonic() - self.prev_time)
+        if wait > 0:
+            time.sleep(wait)
+
+        self._take(self.next_sample)
+        self.prev_time = time.monotonic()
+
+        metrics_get = self.metrics_get_type()
+        metrics_get.version = self.metrics_get_version
+        metrics_get.sample1 = self.prev_sample
+        metrics_get.sample2 = self.next_sample
+        metrics_get.numMetrics = len(self.metric_ids)
+        for i, metric_id in enumerate(self.metric_ids):
+            metrics_get.metrics[i].metricId = metric_id
+        pynvml.nvmlGpmMetricsGet(metrics_get)
+
+        self.prev_sample, self.next_sample = self.next_sample, self.prev_sample
+
+        ids = []
+        names = []
+        values = []
+        units = []
+        ids_append = ids.append
+        names_append = names.append
+        values_append = values.append
+        units_append = units.append
+        for i in range(len(self.metric_ids)):
+            metric = metrics_get.metrics[i]
+            if metric.nvmlReturn != pynvml.NVML_SUCCESS:
+                continue
+
+            info = self.metric_info.get(metric.metricId)
+            if info is None:
+                long_name = metric.metricInfo.longName
+                unit = metric.metricInfo.unit
+                info = (
+                    (long_name.decode() if long_name else 'Unknown').replace(' ', '_'),
+                    unit.decode() if unit else '',
+                )
+                self.metric_info[metric.metricId] = info
+
+            ids_append(metric.metricId)
+            names_append(info[0])
+            # Kept as the double; CSV rows format it like the reader does
+            values_append(metric.value)
+            units_append(info[1])
+
+        return Sample(*self.device_fields, ids, names, values, units)
+
+    def close(self):
+        pynvml.nvmlGpmSampleFree(self.prev_sample)
+        pynvml.nvmlGpmSampleFree(self.next_sample)
+        pynvml.nvmlShutdown()
+
+
+class RawFileWriter:
+    """Buffered file output written with os.write on a raw fd
+
+    Bypasses the file object's lock and buffering: write() takes already
+    encoded bytes into a bytearray which goes out in one syscall when it
+    fills up or on flush().
+    """
+
+    def __init__(self, path, buffer_size=OUTPUT_BUFFER_SIZE):
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.buffer = bytearray()
+        self.buffer_size = buffer_size
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        written = 0
+        with memoryview(self.buffer) as view:
+            while written < len(view):
+                written += os.write(self.fd, view[written:])
+        self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        os.close(self.fd)
+
+
+class ParquetOutput:
+    """Columnar output for long sessions
+
+    Samples accumulate in per-column lists and are written as one Parquet
+    row group every PARQUET_ROW_GROUP_SAMPLES samples. Repeated strings
+    are dictionary-encoded. With values_are_text the values are the reader
+    binary's text and go through float(); pynvml doubles are stored as is.
+    """
+
+    def __init__(self, path, values_are_text=True):
+        self.values_are_text = values_are_text
+        self.schema = pa.schema([
+            ('timestamp', pa.int64()),
+            ('device_id', pa.int16()),
+            ('device_name', pa.dictionary(pa.int32(), pa.string())),
+            ('gpu_instance_id', pa.int16()),
+            ('compute_instance_id', pa.int16()),
+            ('metric_id', pa.int16()),
+            ('metric_name', pa.dictionary(pa.int32(), pa.string())),
+            ('value', pa.float64()),
+            ('unit', pa.dictionary(pa.int32(), pa.string())),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.columns = {name: [] for name in self.schema.names}
+        self.samples = 0
+
+    def write_samples(self, batch):
+        """Add (timestamp, data) samples to the current row group"""
+        columns = self.columns
+        for timestamp, data in batch:
+            n = len(data.ids)
+            gpu_instance_id = data.gpu_instance_id
+            compute_instance_id = data.compute_instance_id
+            columns['timestamp'].extend(repeat(timestamp, n))
+            columns['device_id'].extend(repeat(int(data.device_id), n))
+            columns['device_name'].extend(repeat(data.device_name, n))
+            columns['gpu_instance_id'].extend(
+                repeat(int(gpu_instance_id) if gpu_instance_id != '' else None, n))
+            columns['compute_instance_id'].extend(
+                repeat(int(compute_instance_id) if compute_instance_id != '' else None, n))
+            columns['metric_id'].extend(map(int, data.ids))
+            columns['metric_name'].extend(data.names)
+            if self.values_are_text:
+                columns['value'].extend(map(float, data.values))
+            else:
+                columns['value'].extend(data.values)
+            columns['unit'].extend(data.units)
+
+        self.samples += len(batch)
+        if self.samples >= PARQUET_ROW_GROUP_SAMPLES:
+            self._write_row_group()
+
+    def _write_row_group(self):
+        if self.columns['timestamp']:
+            self.writer.write_table(pa.table(self.columns, schema=self.schema))
+            for column in self.columns.values():
+                column.clear()
+        self.samples = 0
+
+    def close(self):
+        self._write_row_group()
+        self.writer.close()
+
+
+def _scan_output(lines, metric_info):
+    """Pure-Python equivalent of gpm_parse.parse"""
+    device_id = None
+    device_name = None
+    gpu_instance_id = None
+    compute_instance_id = None
+
+    # Device info and the metrics table are read in the same pass
+    ids = []
+    names = []
+    values = []
+    units = []
+    ids_append = ids.append
+    names_append = names.append
+    values_append = values.append
+    units_append = units.append
+    in_table = False
+    compact = False
+
+    for line in lines:
+        if line.startswith(b'GPU '):
+            match = _GPU_RE.match(line)
+            if match:
+                device_id = match.group(1).decode()
+                device_name = match.group(2).rstrip(b'\r\n').decode()
+            # Each device has its own table, which may be compact or not
+            in_table = False
+            continue
+        if b'MIG Slice' in line:
+            match = _MIG_RE.search(line)
+            if match:
+                gpu_instance_id = match.group(1).decode()
+                compute_instance_id = match.group(2).decode()
+            continue
+
+        # Metric rows follow the table header; the separator and blank
+        # lines simply don't match
+        if not in_table:
+            in_table = b'ID' in line and b'Value' in line
+            compact = in_table and b'Name' not in line
+            continue
+
+        if compact:
+            # ID Value Status: split() and isdigit() run in C
+            parts = line.split()
+            if len(parts) != 3 or parts[2] != b'OK' or not parts[0].isdigit():
+                continue
+            info = metric_info.get(parts[0])
+            if info is None:
+                # Names and units were never seen for this metric
+                continue
+            value = parts[1].decode()
+        else:
+            # Names may contain spaces and units may be empty, so these
+            # rows can't be split on whitespace
+            match = _METRIC_RE.match(line)
+            if not match or match.group(5) != b'OK':
+                continue
+            info = metric_info.get(match.group(1))
+            if info is None:
+                info = (
+                    sys.intern(match.group(1).decode()),
+                    sys.intern(match.group(2).decode().replace(' ', '_')),
+                    sys.intern((match.group(4) or b'').decode()),
+                )
+                metric_info[match.group(1)] = info
+            value = match.group(3).decode()
+
+        ids_append(info[0])
+        names_append(info[1])
+        values_append(value)
+        units_append(info[2])
+
+    return (device_id, device_name, gpu_instance_id, compute_instance_id,
+            ids, names, values, units)
+
 
 class GPMMonitor:
-    def __init__(self, binary_path, interval_ms, output_file=None):
+    def __init__(self, binary_path, interval_ms, output_file=None, *, backend=None,
+                 timestamp_format='epoch_ns', schema_only_first=False,
+                 output_format='csv', reader_format='csv', realtime=False,
+                 pin_cpu=None):
         self.binary_path = binary_path
+        self.backend = backend
+        self.timestamp_format = timestamp_format
+        self.schema_only_first = schema_only_first
+        self.output_format = output_format
+        # The reader's --csv rows are passed straight through, which only
+        # works for CSV output; otherwise its table is parsed
+        self.reader_csv = reader_format == 'csv' and output_format == 'csv'
+        # The reader's metric_id bytes -> (id, name, unit) as interned
+        # strings, from the first row seen for each metric
+        self.metric_info = {}
+        self.proc = None
+        self.proc_samples = 0
+        self.reader_eof = False
+        self.reader_timeout = False
+        # Watches the reader's stdout so a hung reader can't block forever
+        self.selector = selectors.DefaultSelector()
         self.interval_ms = interval_ms
         self.interval_sec = interval_ms / 1000.0
         self.output_file = output_file
         self.running = True
         self.header_written = False
+        self.samples_since_flush = 0
+        self.write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self.dropped_samples = 0
+        # Set by the writer thread if writing the output fails
+        self.writer_error = None
+        # (device_id, device_name, gpu_instance_id, compute_instance_id),
+        # taken from the first sample of each reader/backend
+        self.device_prefix = None
+        # "#META" line -> formatted device columns, for reader --csv rows
+        self.meta_prefixes = {}
+        # Pipe that signals write to while run() waits on the reader
+        self.wakeup_fd = None
+        self.wakeup_write_fd = None
+        self.prev_wakeup_fd = -1
         
         # Setup signal handler for clean exit
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
+        
+        # Before any thread or reader is started, so they inherit it
+        if realtime:
+            self._enable_realtime()
+        if pin_cpu is not None:
+            try:
+                os.sched_setaffinity(0, {pin_cpu})
+            except (AttributeError, OSError) as e:
+                sys.stderr.write(f"Warning: could not pin to CPU {pin_cpu}: {e}\n")
+    
+    def _enable_realtime(self):
+        """Use SCHED_FIFO and lock memory to avoid scheduling and paging stalls"""
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(REALTIME_PRIORITY))
+        except (AttributeError, OSError) as e:
+            sys.stderr.write(f"Warning: could not enable SCHED_FIFO (needs root or CAP_SYS_NICE): {e}\n")
+        
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            if libc.mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+        except (AttributeError, OSError) as e:
+            sys.stderr.write(f"Warning: could not lock memory (needs root or CAP_IPC_LOCK): {e}\n")
+    
+    def _install_wakeup_fd(self):
+        """Make signals wake a select() on the reader
+
+        The reader runs in its own session and doesn't get Ctrl+C, so a
+        wait on its output would otherwise only end at the timeout.
+        """
+        self.wakeup_fd, self.wakeup_write_fd = os.pipe()
+        os.set_blocking(self.wakeup_fd, False)
+        os.set_blocking(self.wakeup_write_fd, False)
+        self.prev_wakeup_fd = signal.set_wakeup_fd(self.wakeup_write_fd)
+        self.selector.register(self.wakeup_fd, selectors.EVENT_READ)
+    
+    def _remove_wakeup_fd(self):
+        """Undo _install_wakeup_fd"""
+        if self.wakeup_fd is None:
+            return
+        signal.set_wakeup_fd(self.prev_wakeup_fd)
+        self.selector.unregister(self.wakeup_fd)
+        os.close(self.wakeup_fd)
+        os.close(self.wakeup_write_fd)
+        self.wakeup_fd = None
+        self.wakeup_write_fd = None
     
     def _signal_handler(self, signum, frame):
         """Handle Ctrl+C gracefully"""
         sys.stderr.write("\n\nStopping monitoring...\n")
         self.running = False
     
-    def _parse_output(self, output):
-        """Parse gpm_metrics_reader output and extract metrics"""
-        lines = output.strip().split('\n')
-        
-        # Find device info
-        device_id = None
-        device_name = None
-        gpu_instance_id = None
-        compute_instance_id = None
-        
-        for line in lines:
-            if line.startswith('GPU '):
-                match = re.match(r'GPU (\d+): (.+)', line)
-                if match:
-                    device_id = match.group(1)
-                    device_name = match.group(2)
-            elif 'MIG Slice' in line:
-                match = re.search(r'GI: (\d+), CI: (\d+)', line)
-                if match:
-                    gpu_instance_id = match.group(1)
-                    compute_instance_id = match.group(2)
-        
-        # Parse metrics table
-        metrics = []
-        in_table = False
-        
-        for line in lines:
-            # Skip header and separator lines
-            if 'ID' in line and 'Name' in line and 'Value' in line:
-                in_table = True
-                continue
-            if '-----' in line:
+    def _spawn_reader(self):
+        """Start gpm_metrics_reader in stream mode"""
+        # Own session so Ctrl+C only reaches us; the reader exits when we
+        # close its stdin
+        args = [self.binary_path, '--stream']
+        if self.reader_csv:
+            args.append('--csv')
+        elif self.schema_only_first:
+            args.append('--schema-only-first')
+        self.proc = subprocess.Popen(
+            args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            # Unbuffered, so select() sees everything not read yet
+            bufsize=0,
+            start_new_session=True
+        )
+        self.proc_samples = 0
+        self.reader_eof = False
+        self.reader_timeout = False
+        self.device_prefix = None
+        self.meta_prefixes = {}
+        self.selector.register(self.proc.stdout, selectors.EVENT_READ)
+    
+    def _stop_reader(self):
+        """Close the reader's stdin and wait for it to exit"""
+        if self.proc is None:
+            return
+        self.selector.unregister(self.proc.stdout)
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc.stdout.close()
+        self.proc = None
+    
+    def _sample_lines(self, deadline):
+        """Yield one sample's lines from the reader, up to the end marker
+
+        Sets reader_eof if the reader's output ends before the marker, and
+        reader_timeout if the marker hasn't arrived by the deadline
+        (time.monotonic()) or monitoring was stopped while waiting. Lines
+        are split off raw reads, so every wait for more output is bounded
+        by the same deadline.
+        """
+        self.reader_eof = False
+        self.reader_timeout = False
+        fd = self.proc.stdout.fileno()
+        pending = b''
+        while True:
+            timeout = deadline - time.monotonic()
+            ready = False
+            if timeout > 0:
+                for key, _ in self.selector.select(timeout):
+                    if key.fileobj is self.proc.stdout:
+                        ready = True
+                    else:
+                        # Woken by a signal
+                        os.read(self.wakeup_fd, 512)
+            if timeout <= 0 or not self.running:
+                self.reader_timeout = True
+                return
+            if not ready:
                 continue
-            
-            if in_table and line.strip():
-                # Parse metric line: ID, Name, Value, Unit, Status
-                parts = line.split()
-                if len(parts) >= 5 and parts[0].isdigit():
-                    try:
-                        metric_id = parts[0]
-                        # Name could be multiple words, find where value starts
-                        value_idx = -1
-                        for i, part in enumerate(parts[1:], 1):
-                            try:
-                                float(part)
-                                value_idx = i
-                                break
-                            except ValueError:
-                                continue
-                        
-                        if value_idx > 0:
-                            metric_name = '_'.join(parts[1:value_idx])
-                            metric_value = parts[value_idx]
-                            metric_unit = parts[value_idx + 1] if value_idx + 1 < len(parts) else ''
-                            metric_status = parts[-1]
-                            
-                            if metric_status == 'OK':
-                                metrics.append({
-                                    'id': metric_id,
-                                    'name': metric_name,
-                                    'value': metric_value,
-                                    'unit': metric_unit
-                                })
-                    except (ValueError, IndexError):
-                        continue
+            chunk = os.read(fd, READER_READ_SIZE)
+            if not chunk:
+                self.reader_eof = True
+                return
+            lines = (pending + chunk).splitlines(True)
+            # The last line may be cut off mid-read
+            pending = b'' if lines[-1].endswith(b'\n') else lines.pop()
+            for line in lines:
+                if line == STREAM_END_LINE:
+                    return
+                yield line
+    
+    def _parse_output(self, lines):
+        """Parse gpm_metrics_reader output lines and extract metrics"""
+        if gpm_parse is not None:
+            fields = gpm_parse.parse(lines, self.metric_info)
+        else:
+            fields = _scan_output(lines, self.metric_info)
         
-        return {
-            'device_id': device_id or '0',
-            'device_name': device_name or 'Unknown',
-            'gpu_instance_id': gpu_instance_id or '',
-            'compute_instance_id': compute_instance_id or '',
-            'metrics': metrics
-        }
+        (device_id, device_name, gpu_instance_id, compute_instance_id,
+         ids, names, values, units) = fields
+        return Sample(
+            device_id or '0',
+            device_name or 'Unknown',
+            gpu_instance_id or '',
+            compute_instance_id or '',
+            ids,
+            names,
+            values,
+            units
+        )
     
     def _write_csv_header(self, out):
         """Write CSV header"""
-        out.write("timestamp,device_id,device_name,gpu_instance_id,compute_instance_id,")
-        out.write("metric_id,metric_name,value,unit\n")
-        out.flush()
-    
-    def _write_csv_row(self, out, timestamp, data):
-        """Write CSV rows for all metrics"""
-        for metric in data['metrics']:
-            out.write(f"{timestamp},{data['device_id']},{data['device_name']},")
-            out.write(f"{data['gpu_instance_id']},{data['compute_instance_id']},")
-            out.write(f"{metric['id']},{metric['name']},{metric['value']},{metric['unit']}\n")
-        out.flush()
+        out.write(b"timestamp,device_id,device_name,gpu_instance_id,compute_instance_id,")
+        out.write(b"metric_id,metric_name,value,unit\n")
+    
+    def _format_csv_rows(self, timestamp, data):
+        """Format CSV rows for all metrics of one sample"""
+        self.csv_buffer.seek(0)
+        self.csv_buffer.truncate()
+        
+        # zip() and csv.writer build and quote the rows in C
+        device_id, device_name, gpu_instance_id, compute_instance_id = self.device_prefix
+        values = data.values
+        if self.backend is not None:
+            # NVML doubles, at the reader binary's precision so the CSV
+            # doesn't depend on the backend
+            values = map('%.2f'.__mod__, values)
+        self.csv_writer.writerows(zip(
+            repeat(timestamp),
+            repeat(device_id),
+            repeat(device_name),
+            repeat(gpu_instance_id),
+            repeat(compute_instance_id),
+            data.ids,
+            data.names,
+            values,
+            data.units
+        ))
+        return self.csv_buffer.getvalue().encode()
+    
+    def _format_reader_rows(self, timestamp, rows):
+        """Prefix the reader's --csv rows with the timestamp and device columns"""
+        parts = []
+        append = parts.append
+        sample_prefix = None
+        for row in rows:
+            if row.startswith(CSV_META_PREFIX):
+                device_prefix = self.meta_prefixes.get(row)
+                if device_prefix is None:
+                    device_id, gpu_instance_id, compute_instance_id, device_name = (
+                        row[len(CSV_META_PREFIX):].rstrip(b'\n').decode().split(',', 3))
+                    self.csv_buffer.seek(0)
+                    self.csv_buffer.truncate()
+                    self.csv_writer.writerow(
+                        (device_id, device_name, gpu_instance_id, compute_instance_id, ''))
+                    device_prefix = self.csv_buffer.getvalue().rstrip('\n').encode()
+                    self.meta_prefixes[row] = device_prefix
+                sample_prefix = b'%s,%s' % (str(timestamp).encode(), device_prefix)
+            elif sample_prefix is not None:
+                append(sample_prefix)
+                append(row)
+        return b''.join(parts)
+    
+    def _writer_loop(self, out):
+        """Write queued samples until the None sentinel, or record a write error"""
+        try:
+            self._write_batches(out)
+        except Exception as e:
+            self.writer_error = e
+    
+    def _write_batches(self, out):
+        """Write queued samples in batches until the None sentinel"""
+        while True:
+            batch = [self.write_queue.get()]
+            while len(batch) < WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self.write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            done = batch[-1] is None
+            if done:
+                batch.pop()
+            if self.output_format == 'parquet':
+                out.write_samples(batch)
+            else:
+                out.write(b''.join(batch))
+            if done:
+                return
+            if self.output_format == 'parquet':
+                continue
+            
+            # Flush every few samples rather than every sample
+            self.samples_since_flush += len(batch)
+            if self.samples_since_flush >= FLUSH_EVERY_SAMPLES:
+                out.flush()
+                self.samples_since_flush = 0
     
     def run(self, duration_sec=None):
         """Run continuous monitoring"""
-        start_time = time.time()
+        start_time = time.monotonic()
+        next_deadline = start_time
         
         # Open output file or use stdout
-        if self.output_file:
-            out = open(self.output_file, 'w')
+        if self.output_format == 'parquet':
+            out = ParquetOutput(self.output_file, values_are_text=self.backend is None)
+            sys.stderr.write(f"Writing to {self.output_file}\n")
+        elif self.output_file:
+            out = RawFileWriter(self.output_file)
             sys.stderr.write(f"Writing to {self.output_file}\n")
         else:
-            out = sys.stdout
+            out = sys.stdout.buffer
+        
+        self.csv_buffer = io.StringIO()
+        self.csv_writer = csv.writer(self.csv_buffer, lineterminator='\n')
         
+        iteration = 0
+        show_progress = sys.stderr.isatty()
+        self.last_progress = time.monotonic()
+        writer = None
         try:
+            if self.backend is None:
+                self._install_wakeup_fd()
+            
             # Write CSV header
-            self._write_csv_header(out)
+            if self.output_format == 'csv':
+                self._write_csv_header(out)
+            
+            # File I/O happens on the writer thread so it can't stall sampling
+            writer = threading.Thread(target=self._writer_loop, args=(out,), daemon=True)
+            writer.start()
             
-            iteration = 0
             while self.running:
+                # The writer thread stops on a write error, after which
+                # samples would only pile up in the queue
+                if self.writer_error is not None:
+                    sys.stderr.write(f"\nError writing output: {self.writer_error}\n")
+                    break
+                
                 # Check duration
-                if duration_sec and (time.time() - start_time) >= duration_sec:
+                if duration_sec and (time.monotonic() - start_time) >= duration_sec:
                     sys.stderr.write(f"\nReached duration limit of {duration_sec}s\n")
                     break
                 
-                iter_start = time.time()
-                
-                # Run gpm_metrics_reader
                 try:
-                    result = subprocess.run(
-                        [self.binary_path],
-                        capture_output=True,
-                        text=True,
-                        timeout=10
-                    )
-                    
-                    if result.returncode == 0:
-                        # Parse output
-                        data = self._parse_output(result.stdout)
+                    if self.backend is not None:
+                        data = self.backend.sample()
+                    else:
+                        if self.proc is None:
+                            self._spawn_reader()
                         
-                        # Get timestamp
-                        timestamp = datetime.now().isoformat()
+                        # Request one sample from the running reader and parse
+                        # it straight off the pipe
+                        try:
+                            self.proc.stdin.write(b'\n')
+                            self.proc.stdin.flush()
+                            lines = self._sample_lines(time.monotonic() + READER_TIMEOUT_SEC)
+                            if self.reader_csv:
+                                rows = list(lines)
+                            else:
+                                data = self._parse_output(lines)
+                        except BrokenPipeError:
+                            self.reader_eof = True
                         
-                        # Write CSV rows
-                        self._write_csv_row(out, timestamp, data)
+                        if self.reader_timeout:
+                            # Also when it stalls partway through a sample, or
+                            # when stopped while it hadn't answered yet
+                            if self.running:
+                                sys.stderr.write(f"\nTimeout running {self.binary_path}, restarting\n")
+                            self.proc.kill()
+                            self._stop_reader()
+                            continue
                         
-                        iteration += 1
-                        if iteration % 10 == 0:
+                        if self.reader_eof:
+                            returncode = self.proc.wait()
+                            restart = self.proc_samples > 0
+                            self._stop_reader()
+                            if not restart:
+                                sys.stderr.write(f"\nError running {self.binary_path}: exit code {returncode}\n")
+                                break
+                            sys.stderr.write(f"\n{self.binary_path} exited with code {returncode}, restarting\n")
+                            continue
+                        self.proc_samples += 1
+                    
+                    # Get timestamp
+                    if self.timestamp_format == 'epoch_ns':
+                        timestamp = time.time_ns()
+                    else:
+                        timestamp = datetime.now().isoformat()
+                    
+                    # Queue CSV rows, or the sample itself for Parquet, for
+                    # the writer thread
+                    if self.backend is None and self.reader_csv:
+                        chunk = self._format_reader_rows(timestamp, rows)
+                    else:
+                        if self.device_prefix is None:
+                            self.device_prefix = (
+                                data.device_id,
+                                data.device_name,
+                                data.gpu_instance_id,
+                                data.compute_instance_id
+                            )
+                        if self.output_format == 'parquet':
+                            chunk = (timestamp, data)
+                        else:
+                            chunk = self._format_csv_rows(timestamp, data)
+                    try:
+                        self.write_queue.put_nowait(chunk)
+                    except queue.Full:
+                        self.dropped_samples += 1
+                    
+                    iteration += 1
+                    if show_progress:
+                        now = time.monotonic()
+                        if now - self.last_progress >= PROGRESS_INTERVAL_SEC:
                             sys.stderr.write(f"\rSamples collected: {iteration}")
                             sys.stderr.flush()
-                    else:
-                        sys.stderr.write(f"\nError running {self.binary_path}: {result.stderr}\n")
-                        break
+                            self.last_progress = now
                 
-                except subprocess.TimeoutExpired:
-                    sys.stderr.write(f"\nTimeout running {self.binary_path}\n")
-                    continue
                 except FileNotFoundError:
                     sys.stderr.write(f"\nBinary not found: {self.binary_path}\n")
                     break
+                except _NVMLError as e:
+                    sys.stderr.write(f"\nNVML error: {e}\n")
+                    break
                 
-                # Sleep for remaining interval time
-                elapsed = time.time() - iter_start
-                sleep_time = max(0, self.interval_sec - elapsed)
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
+                # Sleep until the next tick of a fixed schedule, so time spent
+                # sampling does not accumulate as drift
+                next_deadline += self.interval_sec
+                delay = next_deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                elif delay < -self.interval_sec:
+                    # Overran by more than a period: resync instead of bursting
+                    next_deadline = time.monotonic()
         
         finally:
-            if self.output_file and out != sys.stdout:
-                out.close()
+            # Also reached on SIGINT/SIGTERM, which only stop the loop
+            if writer is not None and writer.is_alive():
+                self.write_queue.put(None)
+                writer.join()
+            # Closing would retry the write that already failed
+            if self.writer_error is None:
+                if self.output_file:
+                    out.close()
+                else:
+                    out.flush()
+            if self.backend is not None:
+                self.backend.close()
+            self._stop_reader()
+            self._remove_wakeup_fd()
             sys.stderr.write(f"\n\nTotal samples collected: {iteration}\n")
+            if self.dropped_samples:
+                sys.stderr.write(f"Samples dropped (writer too slow): {self.dropped_samples}\n")
 
 
 def main():
@@ -229,27 +929,144 @@ def main():
     parser.add_argument(
         '--binary',
         type=str,
-        default='./gpm_metrics_reader',
-        help='Path to gpm_metrics_reader binary (default: ./gpm_metrics_reader)'
+        default=None,
+        help='Use the gpm_metrics_reader binary instead of pynvml '
+             '(default without pynvml: ./gpm_metrics_reader)'
+    )
+    
+    parser.add_argument(
+        '--device',
+        type=int,
+        default=None,
+        help='GPU index for the pynvml backend (default: 0)'
+    )
+    
+    parser.add_argument(
+        '--gpu-instance',
+        type=int,
+        default=None,
+        help='MIG GPU instance ID for the pynvml backend (default: none)'
+    )
+    
+    parser.add_argument(
+        '--timestamp',
+        choices=['epoch_ns', 'iso'],
+        default='epoch_ns',
+        help='Timestamp column format: nanoseconds since the epoch or ISO 8601 '
+             'local time (default: epoch_ns)'
+    )
+    
+    parser.add_argument(
+        '--schema-only-first',
+        action='store_true',
+        help='Ask the reader binary to print metric names and units only in its '
+             'first sample, sending just IDs and values afterwards'
+    )
+    
+    parser.add_argument(
+        '--format',
+        choices=['csv', 'parquet'],
+        default='csv',
+        help='Output format (default: csv). parquet needs pyarrow and stores '
+             'epoch_ns timestamps'
+    )
+    
+    parser.add_argument(
+        '--reader-format',
+        choices=['csv', 'table'],
+        default=None,
+        help='How the reader binary prints samples: csv rows passed straight '
+             'into CSV output, or its table parsed every sample (default: csv; '
+             'table for parquet output or --schema-only-first)'
+    )
+    
+    parser.add_argument(
+        '--realtime',
+        action='store_true',
+        help='Run with SCHED_FIFO priority and locked memory to reduce wakeup '
+             'jitter (needs root; mostly useful below ~50ms intervals)'
+    )
+    
+    parser.add_argument(
+        '--pin-cpu',
+        type=int,
+        default=None,
+        help='Pin the monitor process to this CPU'
     )
     
     args = parser.parse_args()
     
+    if args.format == 'parquet':
+        if pa is None:
+            parser.error("--format parquet requires pyarrow (pip install pyarrow)")
+        if args.timestamp != 'epoch_ns':
+            parser.error("--format parquet only supports --timestamp epoch_ns")
+    
+    if args.reader_format is None:
+        args.reader_format = 'table' if args.format == 'parquet' or args.schema_only_first else 'csv'
+    elif args.reader_format == 'csv' and (args.format == 'parquet' or args.schema_only_first):
+        parser.error("--reader-format csv can't be combined with --format parquet "
+                     "or --schema-only-first")
+    
     # Validate interval
     if args.interval < 150:
         sys.stderr.write("Warning: interval < 150ms may be too fast (GPM sampling needs >100ms)\n")
     
+    nvml_options = args.device is not None or args.gpu_instance is not None
+    if args.binary is not None and nvml_options:
+        parser.error("--device and --gpu-instance only apply to the pynvml backend, "
+                     "not --binary")
+    
+    # Prefer in-process sampling, keep the reader binary as a fallback
+    backend = None
+    if args.binary is None and pynvml is not None:
+        try:
+            # The backend samples one GPU or GPU instance while the reader
+            # samples every GPU and MIG slice, so without --device or
+            # --gpu-instance it is only used when those are the same
+            if nvml_options or NvmlBackend.single_whole_gpu():
+                backend = NvmlBackend(args.device or 0, args.gpu_instance)
+            else:
+                sys.stderr.write("Found several GPUs or MIG slices, sampling all of them "
+                                 "with ./gpm_metrics_reader (--device N samples one "
+                                 "through pynvml)\n")
+        except (_NVMLError, RuntimeError, AttributeError) as e:
+            # AttributeError: this pynvml predates the GPM bindings
+            sys.stderr.write(f"Warning: can't sample GPM through pynvml ({e}), "
+                             "falling back to ./gpm_metrics_reader\n")
+    if backend is None and args.binary is None:
+        if nvml_options:
+            sys.stderr.write("Warning: --device and --gpu-instance are ignored by "
+                             "gpm_metrics_reader, which samples every device\n")
+        args.binary = './gpm_metrics_reader'
+    
     # Create and run monitor
-    monitor = GPMMonitor(args.binary, args.interval, args.output)
+    monitor = GPMMonitor(
+        args.binary,
+        args.interval,
+        args.output,
+        backend=backend,
+        timestamp_format=args.timestamp,
+        schema_only_first=args.schema_only_first,
+        output_format=args.format,
+        reader_format=args.reader_format,
+        realtime=args.realtime,
+        pin_cpu=args.pin_cpu
+    )
     
     sys.stderr.write(f"Starting GPM monitoring...\n")
-    sys.stderr.write(f"  Binary: {args.binary}\n")
+    if backend is not None:
+        sys.stderr.write(f"  Backend: pynvml (GPU {args.device or 0})\n")
+    else:
+        sys.stderr.write(f"  Binary: {args.binary}\n")
     sys.stderr.write(f"  Interval: {args.interval}ms\n")
     sys.stderr.write(f"  Duration: {args.duration}s\n" if args.duration else "  Duration: infinite\n")
     sys.stderr.write(f"  Output: {args.output}\n" if args.output else "  Output: stdout\n")
     sys.stderr.write(f"\nPress Ctrl+C to stop\n\n")
     
     monitor.run(args.duration)
+    if monitor.writer_error is not None:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
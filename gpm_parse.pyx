@@ -0,0 +1,204 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Compiled parser for gpm_metrics_reader output
+
+Scans each line of the reader's output, read from the pipe as bytes, as a C
+buffer and returns the same fields as gpm_monitor._scan_output, the
+pure-Python parser used when this module isn't built.
+
+Build:
+    python setup.py build_ext --inplace
+"""
+
+import sys
+
+from cpython.unicode cimport PyUnicode_DecodeUTF8
+from libc.string cimport memcmp
+
+cdef enum:
+    # Tokens per line; longer lines can't be metric rows
+    MAX_TOKENS = 64
+
+
+cdef inline bint is_space(char c):
+    return c == b' ' or c == b'\t' or c == b'\r' or c == b'\f' or c == b'\v'
+
+
+cdef inline bint is_digit(char c):
+    return b'0' <= c <= b'9'
+
+
+cdef inline str decode(const char *s, Py_ssize_t n):
+    return PyUnicode_DecodeUTF8(s, n, NULL)
+
+
+cdef Py_ssize_t find(const char *s, Py_ssize_t n, const char *needle, Py_ssize_t m):
+    cdef Py_ssize_t i
+    for i in range(n - m + 1):
+        if s[i] == needle[0] and memcmp(s + i, needle, m) == 0:
+            return i
+    return -1
+
+
+cdef Py_ssize_t skip_digits(const char *s, Py_ssize_t i, Py_ssize_t n):
+    while i < n and is_digit(s[i]):
+        i += 1
+    return i
+
+
+cdef bint is_number(const char *s, Py_ssize_t n):
+    """Match -?\\d+(\\.\\d+)?([eE][-+]?\\d+)? against the whole of s"""
+    cdef Py_ssize_t i = 0
+    cdef Py_ssize_t start
+    if i < n and s[i] == b'-':
+        i += 1
+    start = i
+    i = skip_digits(s, i, n)
+    if i == start:
+        return False
+    if i < n and s[i] == b'.':
+        start = i = i + 1
+        i = skip_digits(s, i, n)
+        if i == start:
+            return False
+    if i < n and (s[i] == b'e' or s[i] == b'E'):
+        i += 1
+        if i < n and (s[i] == b'+' or s[i] == b'-'):
+            i += 1
+        start = i
+        i = skip_digits(s, i, n)
+        if i == start:
+            return False
+    return i == n
+
+
+def parse(lines, dict metric_info):
+    """Parse reader output lines into (device_id, device_name, gpu_instance_id,
+    compute_instance_id, ids, names, values, units)
+
+    Device fields not present in the output are None. metric_info is the
+    metric_id bytes -> (id, name, unit) cache shared with the Python parser.
+    """
+    cdef bytes data
+    cdef Py_ssize_t n, i, j, at, k
+    cdef const char *line
+    cdef bint in_table = False
+    cdef bint compact = False
+    cdef Py_ssize_t starts[MAX_TOKENS]
+    cdef Py_ssize_t ends[MAX_TOKENS]
+    cdef int ntok, value_tok
+
+    device_id = None
+    device_name = None
+    gpu_instance_id = None
+    compute_instance_id = None
+    ids = []
+    names = []
+    values = []
+    units = []
+
+    for data in lines:
+        line = data
+        n = len(data)
+        if n and line[n - 1] == b'\n':
+            n -= 1
+        if n and line[n - 1] == b'\r':
+            n -= 1
+
+        # GPU (\d+): (.+)
+        if n >= 4 and memcmp(line, b'GPU ', 4) == 0:
+            i = skip_digits(line, 4, n)
+            if i > 4 and i + 2 < n and line[i] == b':' and line[i + 1] == b' ':
+                device_id = decode(line + 4, i - 4)
+                device_name = decode(line + i + 2, n - i - 2)
+            in_table = False
+            continue
+
+        # GI: (\d+), CI: (\d+)
+        if find(line, n, b'MIG Slice', 9) >= 0:
+            at = 0
+            while True:
+                k = find(line + at, n - at, b'GI: ', 4)
+                if k < 0:
+                    break
+                at += k + 4
+                i = skip_digits(line, at, n)
+                if i == at or i + 6 > n or memcmp(line + i, b', CI: ', 6) != 0:
+                    continue
+                j = skip_digits(line, i + 6, n)
+                if j == i + 6:
+                    continue
+                gpu_instance_id = decode(line + at, i - at)
+                compute_instance_id = decode(line + i + 6, j - i - 6)
+                break
+            continue
+
+        # Metric rows follow the table header
+        if not in_table:
+            in_table = find(line, n, b'ID', 2) >= 0 and find(line, n, b'Value', 5) >= 0
+            compact = in_table and find(line, n, b'Name', 4) < 0
+            continue
+
+        ntok = 0
+        i = 0
+        while i < n:
+            while i < n and is_space(line[i]):
+                i += 1
+            if i == n:
+                break
+            if ntok == MAX_TOKENS:
+                ntok = -1
+                break
+            starts[ntok] = i
+            while i < n and not is_space(line[i]):
+                i += 1
+            ends[ntok] = i
+            ntok += 1
+        if ntok < 3 or skip_digits(line, starts[0], ends[0]) != ends[0]:
+            continue
+        if ends[ntok - 1] - starts[ntok - 1] != 2 or memcmp(line + starts[ntok - 1], b'OK', 2) != 0:
+            continue
+
+        metric_id = line[starts[0]:ends[0]]
+
+        if compact:
+            # ID Value Status
+            if ntok != 3:
+                continue
+            info = metric_info.get(metric_id)
+            if info is None:
+                # Names and units were never seen for this metric
+                continue
+            value = decode(line + starts[1], ends[1] - starts[1])
+        else:
+            # ID Name... Value Unit Status, where Unit may be empty. Units
+            # are never numbers, so a number before the status is the value
+            if ntok >= 4 and is_number(line + starts[ntok - 2], ends[ntok - 2] - starts[ntok - 2]):
+                value_tok = ntok - 2
+            elif ntok >= 5 and is_number(line + starts[ntok - 3], ends[ntok - 3] - starts[ntok - 3]):
+                value_tok = ntok - 3
+            else:
+                continue
+
+            info = metric_info.get(metric_id)
+            if info is None:
+                name = decode(line + starts[1], ends[value_tok - 1] - starts[1])
+                if value_tok == ntok - 3:
+                    unit = decode(line + starts[ntok - 2], ends[ntok - 2] - starts[ntok - 2])
+                else:
+                    unit = ''
+                info = (
+                    sys.intern(decode(line + starts[0], ends[0] - starts[0])),
+                    sys.intern(name.replace(' ', '_')),
+                    sys.intern(unit),
+                )
+                metric_info[metric_id] = info
+            value = decode(line + starts[value_tok], ends[value_tok] - starts[value_tok])
+
+        ids.append(info[0])
+        names.append(info[1])
+        values.append(value)
+        units.append(info[2])
+
+    return (device_id, device_name, gpu_instance_id, compute_instance_id,
+            ids, names, values, units)
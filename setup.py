@@ -0,0 +1,23 @@
+"""
+Builds the optional compiled parser used by gpm_monitor.py:
+
+    python setup.py build_ext --inplace
+
+Without Cython only gpm_monitor.py is installed and the pure-Python parser
+is used.
+"""
+
+from setuptools import setup, Extension
+
+try:
+    from Cython.Build import cythonize
+except ImportError:
+    ext_modules = []
+else:
+    ext_modules = cythonize([Extension('gpm_parse', ['gpm_parse.pyx'])])
+
+setup(
+    name='gpm-metrics',
+    py_modules=['gpm_monitor'],
+    ext_modules=ext_modules,
+)
@@ -0,0 +1,153 @@
+"""
+Checks the pure-Python reader output parser, and that the Cython build in
+gpm_parse.pyx returns exactly the same fields when it is built:
+
+    python -m unittest test_gpm_parse
+"""
+
+import unittest
+
+import gpm_monitor
+
+try:
+    import gpm_parse
+except ImportError:
+    gpm_parse = None
+
+
+HEADER = (
+    b'  ID    Name                                       Value       Unit   Status\n'
+    b'  ----- ----------------------------------- ------------ ---------- --------\n'
+)
+COMPACT_HEADER = (
+    b'  ID           Value   Status\n'
+    b'  ----- ------------ --------\n'
+)
+
+# gpm_metrics_reader --stream output, captured up to (not including) #END
+FULL_SAMPLE = (
+    b'\n'
+    b'======================================================================\n'
+    b'GPU 0: NVIDIA GH200 480GB\n'
+    b'UUID: GPU-0\n'
+    b'\n'
+    + HEADER +
+    b'  1     Graphics Activity                          93.83          %       OK\n'
+    b'  5     Any Tensor Util                            77.93          %       OK\n'
+    b'  7     N/A                                          N/A                FAIL\n'
+    b'  20    PCIe TX Bandwidth                          86.90      MiB/s       OK\n'
+    b'  21    Ratio                                       0.59                  OK\n'
+    b'  22    Engine 2                                   12.50                  OK\n'
+    b'  23    N/A                                          N/A                MISS\n'
+    b'\n'
+    b'======================================================================\n'
+    b'\n'
+)
+
+COMPACT_SAMPLE = (
+    b'GPU 0: NVIDIA GH200 480GB\n'
+    b'UUID: GPU-0\n'
+    b'\n'
+    + COMPACT_HEADER +
+    b'  1            40.67       OK\n'
+    b'  5            40.22       OK\n'
+    b'  7              N/A     FAIL\n'
+    b'  20           62.29       OK\n'
+    b'  21           73.73       OK\n'
+    b'  22            1.00       OK\n'
+    b'  30            5.00       OK\n'
+)
+
+# Two MIG slices; the second is compact because the first already sent
+# every name and unit
+MIG_SAMPLE = (
+    b'GPU 0: NVIDIA GH200 480GB\n'
+    b'UUID: GPU-0\n'
+    b'MIG Slice - GI: 1, CI: 0\n'
+    b'\n'
+    + HEADER +
+    b'  1     Graphics Activity                          93.83          %       OK\n'
+    b'  21    Ratio                                       0.59                  OK\n'
+    b'\n'
+    b'GPU 0: NVIDIA GH200 480GB\n'
+    b'UUID: GPU-0\n'
+    b'MIG Slice - GI: 2, CI: 0\n'
+    b'\n'
+    + COMPACT_HEADER +
+    b'  1            77.63       OK\n'
+    b'  21           51.23       OK\n'
+)
+
+
+def lines(text):
+    return text.splitlines(True)
+
+
+class ScanOutputTest(unittest.TestCase):
+
+    def test_full_table(self):
+        metric_info = {}
+        fields = gpm_monitor._scan_output(lines(FULL_SAMPLE), metric_info)
+        self.assertEqual(fields, (
+            '0', 'NVIDIA GH200 480GB', None, None,
+            ['1', '5', '20', '21', '22'],
+            ['Graphics_Activity', 'Any_Tensor_Util', 'PCIe_TX_Bandwidth', 'Ratio', 'Engine_2'],
+            ['93.83', '77.93', '86.90', '0.59', '12.50'],
+            ['%', '%', 'MiB/s', '', ''],
+        ))
+        self.assertEqual(sorted(metric_info), [b'1', b'20', b'21', b'22', b'5'])
+
+    def test_compact_rows_use_cached_schema(self):
+        metric_info = {}
+        gpm_monitor._scan_output(lines(FULL_SAMPLE), metric_info)
+        fields = gpm_monitor._scan_output(lines(COMPACT_SAMPLE), metric_info)
+        # Metric 30 never had its name and unit sent
+        self.assertEqual(fields[4:], (
+            ['1', '5', '20', '21', '22'],
+            ['Graphics_Activity', 'Any_Tensor_Util', 'PCIe_TX_Bandwidth', 'Ratio', 'Engine_2'],
+            ['40.67', '40.22', '62.29', '73.73', '1.00'],
+            ['%', '%', 'MiB/s', '', ''],
+        ))
+
+    def test_mig_slices(self):
+        fields = gpm_monitor._scan_output(lines(MIG_SAMPLE), {})
+        self.assertEqual(fields[2:4], ('2', '0'))
+        self.assertEqual(fields[4], ['1', '21', '1', '21'])
+        self.assertEqual(fields[6], ['93.83', '0.59', '77.63', '51.23'])
+
+    def test_row_without_name_is_skipped(self):
+        text = HEADER + b'  1     ' + b' ' * 35 + b'        93.83          %       OK\n'
+        self.assertEqual(gpm_monitor._scan_output(lines(text), {})[4], [])
+
+
+@unittest.skipIf(gpm_parse is None, "gpm_parse is not built")
+class CompiledParserTest(unittest.TestCase):
+
+    def assert_same(self, *samples):
+        python_info = {}
+        compiled_info = {}
+        for sample in samples:
+            self.assertEqual(
+                gpm_parse.parse(lines(sample), compiled_info),
+                gpm_monitor._scan_output(lines(sample), python_info),
+            )
+        self.assertEqual(compiled_info, python_info)
+
+    def test_full_then_compact(self):
+        self.assert_same(FULL_SAMPLE, COMPACT_SAMPLE)
+
+    def test_mig_slices(self):
+        self.assert_same(MIG_SAMPLE)
+
+    def test_edge_rows(self):
+        self.assert_same(
+            HEADER + b'  1     ' + b' ' * 35 + b'        93.83          %       OK\n',
+            HEADER + b'  2     Foo 2                                      93.83                  OK\n',
+            HEADER + b'  3     Foo 2                                      93.83          %       OK\n',
+            HEADER + b'  4     Throughput                               1.5e+03     GB/s       OK\n',
+            b'',
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()